@@ -0,0 +1,49 @@
+import argparse
+import gc
+import inspect
+import timeit
+
+from benchmarks import bench_bevstat
+
+
+#minimal runner for the asv-style classes in bench_bevstat, e.g.:
+#python -m benchmarks --scales 1,10 --filter Callbacks
+
+def run(scales, name_filter, repeat):
+    for class_name, benchmark_class in inspect.getmembers(bench_bevstat, inspect.isclass):
+        if benchmark_class.__module__ != bench_bevstat.__name__:
+            continue
+        methods = [name for name in dir(benchmark_class)
+                   if name.startswith("time_") and name_filter in class_name + "." + name]
+        if not methods:
+            continue
+        for scale in benchmark_class.params:
+            if scale not in scales:
+                continue
+            benchmark = benchmark_class()
+            try:
+                benchmark.setup(scale)
+            except NotImplementedError:
+                print("{}.* [scale={}]: skipped".format(class_name, scale), flush=True)
+                continue
+            try:
+                for name in methods:
+                    #timeit disables gc, script runs leave cyclic garbage (bokeh documents) that adds up to
+                    #gigabytes at the large scales without it
+                    timer = timeit.Timer(lambda: getattr(benchmark, name)(scale), setup=gc.enable)
+                    number, _ = timer.autorange()
+                    best = min(timer.repeat(repeat=repeat, number=number)) / number
+                    print("{}.{} [scale={}]: {:.3f} ms".format(class_name, name, scale, best * 1000), flush=True)
+            finally:
+                if hasattr(benchmark, "teardown"):
+                    benchmark.teardown(scale)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run the bevstat benchmarks")
+    parser.add_argument("--scales", default=",".join(str(scale) for scale in bench_bevstat.scales),
+                        help="comma separated dataset scales, 1 is the real pop_data")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose Class.method contains this")
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+    run([int(scale) for scale in options.scales.split(",")], options.filter, options.repeat)
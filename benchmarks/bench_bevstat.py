@@ -0,0 +1,178 @@
+import importlib.util
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+from os import path
+
+import bevstat_core
+from benchmarks.synthetic import write_synthetic_data
+
+
+#asv-style benchmarks: setup(scale) prepares, every time_* method is timed,
+#raising NotImplementedError in setup skips a parameter combination
+
+repo_dir = path.dirname(path.dirname(path.abspath(__file__)))
+scales = [1, 10, 100, 1000]
+#parsing 1000x as text would take minutes and gigabytes, the binary cube covers that scale
+max_text_scale = 100
+
+
+def synthetic_data_dir(scale, text=True):
+    #scale 1 is the real pop_data directory
+    if scale == 1:
+        return bevstat_core.data_dir
+    data_dir = tempfile.mkdtemp(prefix="bevstat_bench_{}x_".format(scale))
+    return write_synthetic_data(data_dir, scale, text=text)
+
+
+def run_script(data_dir, script="bevstat_en.py"):
+    #executes a bokeh script against data_dir in a fresh document, returns the script namespace
+    from bokeh.document import Document
+    from bokeh.io.doc import set_curdoc
+
+    work_dir = tempfile.mkdtemp(prefix="bevstat_bench_doc_")
+    os.symlink(data_dir, path.join(work_dir, "pop_data"))
+    document = Document()
+    set_curdoc(document)
+    cwd = os.getcwd()
+    sys_path = list(sys.path)
+    #same cwd and sys.path handling as "bokeh serve"
+    os.chdir(work_dir)
+    sys.path.insert(0, repo_dir)
+    try:
+        namespace = runpy.run_path(path.join(repo_dir, script), run_name="bevstat_bench")
+    finally:
+        os.chdir(cwd)
+        sys.path = sys_path
+        shutil.rmtree(work_dir)
+    namespace["document"] = document
+    return namespace
+
+
+def drain_precompute():
+    #waits for the tables queued by the scripts' precompute scheduler, loading or computing them
+    #in the background must not overlap the timed code
+    import bevstat_precompute
+
+    bevstat_precompute._executor.submit(lambda: None).result()
+
+
+class DataLoad():
+    params = scales
+    param_names = ["scale"]
+
+    def setup(self, scale):
+        if scale > max_text_scale:
+            raise NotImplementedError
+        self.data_dir = synthetic_data_dir(scale)
+        bevstat_core.load_cube(self.data_dir)
+
+    def teardown(self, scale):
+        if self.data_dir != bevstat_core.data_dir:
+            shutil.rmtree(self.data_dir)
+
+    def time_parse_pop_data(self, scale):
+        bevstat_core.parse_cube(self.data_dir)
+        bevstat_core.load_additional_stats(self.data_dir)
+
+    def time_load_binary_cube(self, scale):
+        bevstat_core.load_cube(self.data_dir)
+
+    def time_load_flat_cube(self, scale):
+        bevstat_core.load_flat_cube(self.data_dir)
+
+
+class Indicators():
+    params = scales
+    param_names = ["scale"]
+
+    def setup(self, scale):
+        self.data_dir = synthetic_data_dir(scale, text=False)
+        self.indicators = bevstat_core.Indicators(bevstat_core.load_cube(self.data_dir))
+
+    def teardown(self, scale):
+        if self.data_dir != bevstat_core.data_dir:
+            shutil.rmtree(self.data_dir)
+
+    def time_evaluate_all_years_and_scenarios(self, scale):
+        import numpy as np
+
+        self.indicators.evaluate(np.arange(len(bevstat_core.scenarios)), np.arange(self.indicators.years),
+                                 np.array([18, 20]), np.array([65, 67]))
+
+
+class Callbacks():
+    params = scales
+    param_names = ["scale"]
+
+    def setup(self, scale):
+        if importlib.util.find_spec("bokeh") is None:
+            raise NotImplementedError
+        self.data_dir = synthetic_data_dir(scale, text=False)
+        self.namespace = run_script(self.data_dir)
+        drain_precompute()
+        self.bevstat = self.namespace["bevstat"]
+        self.years = range(self.bevstat.years)
+
+    def teardown(self, scale):
+        if self.data_dir != bevstat_core.data_dir:
+            shutil.rmtree(self.data_dir)
+
+    def time_get_new_display_data(self, scale):
+        for year in self.years:
+            self.bevstat.get_new_display_data(year, 1)
+
+    def time_prepare_dependency_text(self, scale):
+        #bypass the lru_cache, the computation is what is measured
+        prepare_dependency_text = type(self.bevstat).prepare_dependency_text.__wrapped__
+        for year in self.years:
+            prepare_dependency_text(self.bevstat, 18, 67, year, 1)
+
+    def time_prepare_population_text(self, scale):
+        prepare_population_text = type(self.bevstat).prepare_population_text.__wrapped__
+        for year in self.years:
+            prepare_population_text(self.bevstat, year, 1)
+
+    def time_update_stat_plots(self, scale):
+        for radio_active in (0, 1, 2):
+            self.bevstat.update_stat_plots(radio_active)
+
+    def time_update_and_serialize_document(self, scale):
+        self.bevstat.offset_slider.value = (self.bevstat.offset_slider.value + 1) % len(self.years)
+        self.namespace["document"].to_json_string()
+
+    def time_switch_band_levels(self, scale):
+        for band_level in range(len(bevstat_core.band_levels)):
+            self.bevstat.update_band_level(band_level)
+
+
+class Sessions():
+    #a new session of "bokeh serve": the script run plus serializing the document for the browser's first pull
+    params = scales
+    param_names = ["scale"]
+
+    def setup(self, scale):
+        if importlib.util.find_spec("bokeh") is None:
+            raise NotImplementedError
+        import bevstat_template
+
+        self.process_cache = bevstat_template._process_cache
+        self.data_dir = synthetic_data_dir(scale, text=False)
+        run_script(self.data_dir)
+        drain_precompute()
+
+    def teardown(self, scale):
+        if self.data_dir != bevstat_core.data_dir:
+            shutil.rmtree(self.data_dir)
+
+    def time_new_session(self, scale):
+        run_script(self.data_dir)["document"].to_json_string()
+
+    def time_first_session_of_process(self, scale):
+        #data and document template are built by the first session, the precompute scheduler is kept,
+        #a new one would queue its tables again on the shared worker while later runs are timed
+        for key in [key for key in self.process_cache if key != "precompute"]:
+            del self.process_cache[key]
+        run_script(self.data_dir)["document"].to_json_string()
@@ -0,0 +1,58 @@
+import os
+from os import path
+
+import numpy as np
+
+import bevstat_core
+
+
+#synthetic pop_data directories: the real data repeated along the year axis,
+#scale 10 turns 45 historical + 30 predicted years into 450 + 300 years
+
+historical_years = 45
+stats_keys = dict(historical=("historical_ch", "historical_au"),
+                  low=("low_ch", "low_au"),
+                  reference=("ref_ch", "ref_au"),
+                  high=("high_ch", "high_au"))
+
+
+def _tile_years(rows, scale):
+    return np.concatenate([rows] * scale)
+
+
+def _write_stats(data_dir, key, stats, first_year):
+    #stats files are stored year by row, load_additional_stats transposes and negates deaths / emigration
+    stats = np.array(stats)
+    stats[2] *= -1
+    stats[4] *= -1
+    stats[0] = np.arange(first_year, first_year + stats.shape[1])
+    np.savetxt(path.join(data_dir, key + ".stats"), stats.T, fmt="%d", delimiter="\t")
+
+
+def write_synthetic_data(data_dir, scale, text=True):
+    #text=False only writes the stats files and the binary cube cache, parsing csvs of 1000x is not practical
+    os.makedirs(data_dir, exist_ok=True)
+    cube = bevstat_core.load_cube()
+    additional_stats = bevstat_core.load_additional_stats()
+
+    historical = _tile_years(cube[0, :historical_years], scale)
+    predictions = [_tile_years(cube[scenario_index, historical_years:], scale)
+                   for scenario_index in range(len(bevstat_core.scenarios))]
+
+    if text:
+        for num, data_demographic in enumerate(bevstat_core.demographics):
+            np.savetxt(path.join(data_dir, "historical_" + data_demographic + ".csv"),
+                       historical[:, num], fmt="%d", delimiter="\t")
+            for scenario, prediction in zip(bevstat_core.scenarios, predictions):
+                np.savetxt(path.join(data_dir, scenario + "_prediction_" + data_demographic + ".csv"),
+                           prediction[:, num], fmt="%d", delimiter="\t")
+
+    first_predicted_year = bevstat_core.first_recorded_year + len(historical)
+    for scenario, keys in stats_keys.items():
+        for key in keys:
+            first_year = bevstat_core.first_recorded_year if scenario == "historical" else first_predicted_year
+            _write_stats(data_dir, key, np.hstack([additional_stats[key]] * scale), first_year)
+
+    synthetic_cube = np.stack([np.concatenate((historical, prediction)) for prediction in predictions])
+    synthetic_cube.astype(bevstat_core.cube_typecode).tofile(bevstat_core.cube_cache_path(data_dir))
+    return data_dir
@@ -0,0 +1,258 @@
+import hashlib
+import json
+from collections import OrderedDict
+from os import path
+
+import numpy as np
+from tornado import web
+
+import bevstat_core
+from bevstat_core import columns, default_window, scenarios
+
+
+#HTTP query API for the numbers behind the bevstat app
+#
+#GET /api/indicators?years=1971-2045&scenarios=low,reference,high&windows=18-65,20-67&format=json
+#POST /api/indicators with the same keys as a JSON body (lists instead of comma separated strings)
+#
+#every request is answered with one vectorized evaluation over the population cube,
+#omitted keys default to all years, all scenarios and the app's default window 18-67
+
+#responses with more rows than this are streamed in chunks instead of being cached
+stream_threshold = 20000
+chunk_rows = 4096
+#total size of the cached response bodies per process
+response_cache_bytes = 64 * 1024 * 1024
+#larger queries are rejected, every window of every year and scenario is about 1.1 million rows
+max_rows = 1200000
+
+
+class QueryError(ValueError):
+    status_code = 400
+
+
+class QueryTooLarge(QueryError):
+    status_code = 413
+
+
+def _split(value):
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(",") if item.strip()]
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _parse_range(value):
+    #accepts 2030, "2030", "2020-2030" and [2020, 2030]
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return int(value[0]), int(value[1])
+    value = str(value)
+    if "-" in value[1:]:
+        start, end = value.split("-", 1)
+        return int(start), int(end)
+    return int(value), int(value)
+
+
+def parse_query(indicators, years=None, scenarios_=None, windows=None, format_="json"):
+    first_year, last_year = indicators.first_recorded_year, indicators.first_recorded_year + indicators.years - 1
+    try:
+        if years in (None, "", "all"):
+            year_ranges = [(first_year, last_year)]
+        else:
+            year_ranges = [_parse_range(item) for item in _split(years)]
+
+        if scenarios_ in (None, "", "all"):
+            scenario_index = np.arange(len(scenarios))
+        else:
+            scenario_names = _split(scenarios_)
+            unknown = [str(item) for item in scenario_names if item not in scenarios]
+            if unknown:
+                raise QueryError("unknown scenarios {}, choose from {}".format(",".join(unknown), ",".join(scenarios)))
+            scenario_index = np.array([scenarios.index(item) for item in scenario_names], dtype=np.intp)
+            if len(set(scenario_names)) < len(scenario_names):
+                raise QueryError("scenarios must not repeat")
+
+        if windows in (None, ""):
+            windows = [default_window]
+        window_bounds = np.array([_parse_range(item) for item in _split(windows)], dtype=np.intp).reshape(-1, 2)
+    except QueryError:
+        raise
+    except (TypeError, ValueError) as error:
+        raise QueryError("malformed query: {}".format(error))
+
+    #ranges are checked before they are expanded, a range like 0-999999999 is rejected without allocating it
+    if not year_ranges or any(start > end or start < first_year or end > last_year for start, end in year_ranges):
+        raise QueryError("years must lie within {}-{}".format(first_year, last_year))
+    #a year is answered once per query like a scenario, repeating a range would only multiply the work
+    ordered_ranges = sorted(year_ranges)
+    if any(start <= previous_end for (_, previous_end), (start, _) in zip(ordered_ranges, ordered_ranges[1:])):
+        raise QueryError("year ranges must not overlap")
+    if scenario_index.size == 0:
+        raise QueryError("no scenario requested")
+    age_min, age_max = window_bounds[:, 0], window_bounds[:, 1]
+    if age_min.size == 0 or age_min.min() < 0 or age_max.max() > indicators.ages or (age_min >= age_max).any():
+        raise QueryError("age windows must satisfy 0 <= min < max <= {}".format(indicators.ages))
+    if format_ not in ("json", "csv"):
+        raise QueryError("format must be json or csv")
+    rows = scenario_index.size * sum(end - start + 1 for start, end in year_ranges) * age_min.size
+    if rows > max_rows:
+        raise QueryTooLarge("query would return {} rows, at most {} are allowed".format(rows, max_rows))
+    year_index = np.concatenate([np.arange(start, end + 1, dtype=np.intp) for start, end in year_ranges]) - first_year
+    return scenario_index, year_index, age_min, age_max, format_
+
+
+def _rows(result, start, stop):
+    #the result columns are broadcast views, .flat slices copy only the rows of one chunk
+    return list(zip(*(result[column].flat[start:stop].tolist() for column in columns)))
+
+
+def _csv_lines(rows):
+    return "".join("{},{},{},{},{},{},{},{},{},{!r},{!r},{!r}\n".format(*row) for row in rows)
+
+
+def render_chunks(result, format_, version):
+    #yields the response body in pieces of at most chunk_rows rows
+    size = result["year"].size
+    if format_ == "csv":
+        yield ",".join(columns) + "\n"
+        for start in range(0, size, chunk_rows):
+            yield _csv_lines(_rows(result, start, start + chunk_rows))
+    else:
+        yield '{{"data_version": {}, "columns": {}, "rows": ['.format(json.dumps(version), json.dumps(columns))
+        for start in range(0, size, chunk_rows):
+            chunk = json.dumps(_rows(result, start, start + chunk_rows))[1:-1]
+            #same separator as json.dumps uses between the rows inside a chunk
+            yield chunk if start == 0 else ", " + chunk
+        yield "]}"
+
+
+class ResponseCache():
+    #least recently used response bodies, bounded by their total size instead of their number
+    def __init__(self, max_bytes=response_cache_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.bodies = OrderedDict()
+
+    def get(self, key):
+        body = self.bodies.get(key)
+        if body is not None:
+            self.bodies.move_to_end(key)
+        return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes or key in self.bodies:
+            return
+        self.bodies[key] = body
+        self.nbytes += len(body)
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= len(self.bodies.popitem(last=False)[1])
+
+
+content_types = dict(json="application/json; charset=UTF-8", csv="text/csv; charset=UTF-8")
+
+
+class IndicatorHandler(web.RequestHandler):
+    def initialize(self, indicators, cache):
+        self.indicators = indicators
+        self.cache = cache
+        self._etag = None
+
+    def compute_etag(self):
+        return self._etag
+
+    def write_error(self, status_code, **kwargs):
+        #clients get the reason of a rejected query as JSON instead of tornado's html error page
+        error = kwargs.get("exc_info", (None, None, None))[1]
+        message = error.log_message if isinstance(error, web.HTTPError) and error.log_message else self._reason
+        self.set_header("Content-Type", content_types["json"])
+        self.finish(json.dumps(dict(error=message)))
+
+    def get(self):
+        arguments = dict(years=self.get_argument("years", None),
+                         scenarios_=self.get_argument("scenarios", None),
+                         windows=self.get_argument("windows", None),
+                         format_=self.get_argument("format", "json"))
+        return self._answer(arguments)
+
+    def post(self):
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise web.HTTPError(400, "request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise web.HTTPError(400, "request body must be a JSON object")
+        arguments = dict(years=body.get("years"),
+                         scenarios_=body.get("scenarios"),
+                         windows=body.get("windows"),
+                         format_=body.get("format", "json"))
+        return self._answer(arguments)
+
+    async def _answer(self, arguments):
+        try:
+            scenario_index, year_index, age_min, age_max, format_ = parse_query(self.indicators, **arguments)
+        except QueryError as error:
+            raise web.HTTPError(error.status_code, str(error))
+
+        #the normalized query plus the data version identifies the response
+        key = "|".join((self.indicators.version, format_,
+                        scenario_index.tobytes().hex(), year_index.tobytes().hex(),
+                        age_min.tobytes().hex(), age_max.tobytes().hex()))
+        self._etag = '"{}"'.format(hashlib.sha1(key.encode()).hexdigest())
+        self.set_header("Content-Type", content_types[format_])
+        self.set_header("Cache-Control", "public, max-age=3600")
+        self.set_etag_header()
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        body = self.cache.get(key)
+        if body is not None:
+            self.write(body)
+            return
+
+        result = self.indicators.evaluate(scenario_index, year_index, age_min, age_max)
+        chunks = render_chunks(result, format_, self.indicators.version)
+        if result["year"].size <= stream_threshold:
+            body = "".join(chunks).encode()
+            self.cache.put(key, body)
+            self.write(body)
+            return
+
+        for chunk in chunks:
+            self.write(chunk)
+            await self.flush()
+
+
+def make_handlers(prefix="/api", data_dir=bevstat_core.data_dir):
+    indicators = bevstat_core.Indicators(bevstat_core.load_cube(data_dir),
+                                         version=bevstat_core.data_version(data_dir))
+    return [(prefix + "/indicators", IndicatorHandler, dict(indicators=indicators, cache=ResponseCache()))]
+
+
+if __name__ == "__main__":
+    import argparse
+    from tornado.ioloop import IOLoop
+
+    parser = argparse.ArgumentParser(description="serve the bevstat app together with the indicator API")
+    parser.add_argument("--port", type=int, default=5006)
+    parser.add_argument("--api-only", action="store_true", help="serve only the API, without bokeh")
+    parser.add_argument("--app", default="bevstat_en.py", help="bokeh script served next to the API")
+    parser.add_argument("--allow-websocket-origin", action="append", default=None)
+    options = parser.parse_args()
+
+    if options.api_only:
+        web.Application(make_handlers()).listen(options.port)
+        IOLoop.current().start()
+    else:
+        from bokeh.application import Application
+        from bokeh.application.handlers import ScriptHandler
+        from bokeh.server.server import Server
+
+        app_path = path.join(path.dirname(path.abspath(__file__)), options.app)
+        server = Server({"/" + path.splitext(options.app)[0]: Application(ScriptHandler(filename=app_path))},
+                        port=options.port,
+                        allow_websocket_origin=options.allow_websocket_origin,
+                        extra_patterns=make_handlers())
+        server.start()
+        server.io_loop.start()
@@ -0,0 +1,209 @@
+import hashlib
+import os
+from array import array
+from os import path
+
+
+#headless core of bevstat: population cube, indexes and indicator calculations
+#
+#nothing in here imports bokeh, numpy is only imported by the functions working on whole arrays,
+#single lookups (bevstat CLI) run on the binary cube cache with the standard library alone
+
+data_dir = path.join(path.dirname(path.abspath(__file__)), "pop_data")
+first_recorded_year = 1971
+scenarios = ("low", "reference", "high")
+demographics = ("m_ch", "m_au", "f_ch", "f_au")
+ages = 101
+default_window = (18, 67)
+#age bands of the pyramid: a band width in years or the first ages of custom bands
+band_levels = (1, 5, 10, (0, 7, 16, 20, 25, 45, 65, 80))
+
+columns = ("scenario", "year", "age_min", "age_max",
+           "population", "population_male", "population_female", "population_foreign", "population_window",
+           "dependency_ratio", "dependency_ratio_minor", "dependency_ratio_major")
+
+#population counts per age and year are far below 2**31, prefix sums are kept as int64
+cube_typecode = "i"
+
+
+def data_version(data_dir=data_dir):
+    digest = hashlib.sha1()
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith((".csv", ".stats")):
+            stat = os.stat(path.join(data_dir, filename))
+            digest.update("{}:{}:{};".format(filename, stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()[:16]
+
+
+def cube_cache_path(data_dir=data_dir, version=None):
+    return path.join(data_dir, ".cube-{}-{}.bin".format(version or data_version(data_dir), cube_typecode))
+
+
+def parse_cube(data_dir=data_dir):
+    import numpy as np
+
+    #cube[scenario, year, demographic, age], historical years are shared by all scenarios
+    historical = np.stack([np.loadtxt(path.join(data_dir, "historical_" + data_demographic + ".csv"), dtype=int)
+                           for data_demographic in demographics], axis=1)
+    cube = []
+    for scenario in scenarios:
+        prediction = np.stack([np.loadtxt(path.join(data_dir,
+                                                    scenario + "_prediction_" + data_demographic + ".csv"),
+                                          dtype=int)
+                               for data_demographic in demographics], axis=1)
+        cube.append(np.concatenate((historical, prediction)))
+    cube = np.stack(cube)
+    if cube.min() < 0 or cube.max() > np.iinfo(cube_typecode).max:
+        raise ValueError("population counts in {} do not fit the cube dtype".format(data_dir))
+    return np.ascontiguousarray(cube, dtype=cube_typecode)
+
+
+def load_cube(data_dir=data_dir):
+    #parsing the csvs is slow, the cube is kept next to the data as raw binary keyed by data version
+    import numpy as np
+
+    cache_path = cube_cache_path(data_dir)
+    if path.exists(cache_path):
+        return np.fromfile(cache_path, dtype=cube_typecode).reshape(len(scenarios), -1, len(demographics), ages)
+    cube = parse_cube(data_dir)
+    try:
+        cube.tofile(cache_path + ".tmp")
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError:
+        pass
+    return cube
+
+
+def load_flat_cube(data_dir=data_dir):
+    #the cube as flat array.array, without importing numpy whenever the binary cache exists
+    cache_path = cube_cache_path(data_dir)
+    flat = array(cube_typecode)
+    if path.exists(cache_path):
+        with open(cache_path, "rb") as cache_file:
+            flat.frombytes(cache_file.read())
+    else:
+        flat.frombytes(load_cube(data_dir).tobytes())
+    return flat, len(flat) // (len(scenarios) * len(demographics) * ages)
+
+
+def load_additional_stats(data_dir=data_dir):
+    #migration and birth stats per origin and scenario, rows: year, births, deaths, immigration, emigration
+    import numpy as np
+
+    additional_stats = dict()
+    for key in ("historical_ch", "historical_au", "low_ch", "low_au", "ref_ch", "ref_au", "high_ch", "high_au"):
+        additional_stats[key] = np.rot90(np.fliplr(np.loadtxt(path.join(data_dir, key + ".stats"), dtype=np.int32)))
+        additional_stats[key][2] *= -1
+        additional_stats[key][4] *= -1
+    return additional_stats
+
+
+def band_edges(band, ages=ages):
+    #edges of the age bands, the last edge is the total number of ages
+    if isinstance(band, int):
+        starts = list(range(0, ages, band))
+        #a remainder shorter than the band width is merged into the last band, e.g. 95-100 for 5 year bands
+        if len(starts) > 1 and ages - starts[-1] < band:
+            starts.pop()
+        return starts + [ages]
+    starts = sorted(set(band))
+    if starts[0] != 0 or starts[-1] >= ages:
+        raise ValueError("custom age bands must start at 0 and below {}".format(ages))
+    return starts + [ages]
+
+
+def band_cube(cube, edges):
+    #band sums for every scenario, year and demographic
+    import numpy as np
+
+    return np.add.reduceat(cube, edges[:-1], axis=3, dtype=cube.dtype)
+
+
+def band_snap(edges):
+    #nearest band edge for every age, selections snap to the bands by a list lookup
+    return [min(edges, key=lambda edge: abs(edge - age)) for age in range(edges[-1] + 1)]
+
+
+def indicator_values(m_ch, m_au, f_ch, f_au, below_min, below_max):
+    #works on python ints as well as on broadcastable numpy arrays
+    #population counts of the "ch" files include the foreign population ("au")
+    population = m_ch + f_ch
+    dependency_ratio_minor = below_min / (population - below_min)
+    dependency_ratio_major = (population - below_max) / below_max
+    return dict(population=population,
+                population_male=m_ch,
+                population_female=f_ch,
+                population_foreign=m_au + f_au,
+                population_window=below_max - below_min,
+                dependency_ratio=dependency_ratio_minor + dependency_ratio_major,
+                dependency_ratio_minor=dependency_ratio_minor,
+                dependency_ratio_major=dependency_ratio_major)
+
+
+class Indicators():
+    def __init__(self, cube, first_recorded_year=first_recorded_year, version=""):
+        import numpy as np
+
+        self.first_recorded_year = first_recorded_year
+        self.version = version
+        self.years = cube.shape[1]
+        self.ages = cube.shape[3]
+        #prefix sums over age, cumulative[..., a] holds the population younger than a
+        self.cumulative = np.zeros(cube.shape[:3] + (self.ages + 1,), dtype=np.int64)
+        np.cumsum(cube, axis=3, out=self.cumulative[..., 1:])
+        #evaluate gathers from these two, a query only allocates arrays of its own output size
+        #totals[scenario, year, demographic], below[scenario, year, a]: swiss and foreign population younger than a
+        self.totals = np.ascontiguousarray(self.cumulative[..., -1])
+        self.below = self.cumulative[:, :, 0] + self.cumulative[:, :, 2]
+
+    #single lookups go through ndarray.item, which returns python ints without creating numpy temporaries
+    def population(self, scenario_index, year_index):
+        item = self.cumulative.item
+        return (item(scenario_index, year_index, 0, self.ages),
+                item(scenario_index, year_index, 1, self.ages),
+                item(scenario_index, year_index, 2, self.ages),
+                item(scenario_index, year_index, 3, self.ages))
+
+    def dependency(self, scenario_index, year_index, age_min, age_max):
+        item = self.cumulative.item
+        m_ch, m_au, f_ch, f_au = self.population(scenario_index, year_index)
+        values = indicator_values(m_ch, m_au, f_ch, f_au,
+                                  item(scenario_index, year_index, 0, age_min)
+                                  + item(scenario_index, year_index, 2, age_min),
+                                  item(scenario_index, year_index, 0, age_max)
+                                  + item(scenario_index, year_index, 2, age_max))
+        return values["dependency_ratio"], values["dependency_ratio_minor"], values["dependency_ratio_major"]
+
+    def evaluate(self, scenario_index, year_index, age_min, age_max):
+        #shapes: scenario_index (S,), year_index (Y,), age_min / age_max (W,), results (S, Y, W)
+        import numpy as np
+
+        scenario_index, year_index = scenario_index[:, None, None], year_index[None, :, None]
+        #totals (S, Y, 4), below_min / below_max (S, Y, W)
+        totals = self.totals[scenario_index[..., 0], year_index[..., 0]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = indicator_values(*(totals[:, :, demographic, None] for demographic in range(len(demographics))),
+                                      below_min=self.below[scenario_index, year_index, age_min],
+                                      below_max=self.below[scenario_index, year_index, age_max])
+
+        shape = values["population_window"].shape
+        values.update(scenario=np.asarray(scenarios)[scenario_index],
+                      year=year_index + self.first_recorded_year,
+                      age_min=age_min,
+                      age_max=age_max)
+        return dict((column, np.broadcast_to(values[column], shape)) for column in columns)
+
+
+def point_indicators(flat, years, scenario_index, year_index, age_min, age_max):
+    #single (scenario, year, window) lookup on the flat cube from load_flat_cube
+    offset = (scenario_index * years + year_index) * len(demographics) * ages
+    m_ch, m_au, f_ch, f_au = (flat[offset + demographic * ages:offset + (demographic + 1) * ages]
+                              for demographic in range(len(demographics)))
+    values = indicator_values(sum(m_ch), sum(m_au), sum(f_ch), sum(f_au),
+                              sum(m_ch[:age_min]) + sum(f_ch[:age_min]),
+                              sum(m_ch[:age_max]) + sum(f_ch[:age_max]))
+    values.update(scenario=scenarios[scenario_index],
+                  year=year_index + first_recorded_year,
+                  age_min=age_min,
+                  age_max=age_max)
+    return values
@@ -1,39 +1,18 @@
 
 import numpy as np
-from os import path
 from bokeh.io import curdoc
 from bokeh.layouts import row, column, widgetbox, layout
-from bokeh.models import ColumnDataSource, formatters, BoxAnnotation, BoxSelectTool, HoverTool, Span, Label, Button
-from bokeh.models.widgets import Slider, PreText, RadioGroup
+from bokeh.models import ColumnDataSource, formatters, BoxAnnotation, BoxSelectTool, HoverTool, Span, Label, LabelSet, Button
+from bokeh.models.widgets import Slider, PreText, RadioGroup, RadioButtonGroup
 from bokeh.plotting import figure
 from functools import lru_cache
+import bevstat_core
+import bevstat_precompute
+import bevstat_template
+import bevstat_tween
 
 
 data_dir = "pop_data"
-additional_stats = dict()
-additional_stats_source = dict()
-age_data = dict()
-display_stats = dict()
-
-#load data from csvs, actual population counts 1971-2015 and scenarios 2016-2045
-for data_time in ("historical", "low_prediction", "reference_prediction", "high_prediction"):
-    age_data[data_time] = dict()
-    for data_demographic in ("m_ch","m_au","f_ch","f_au"):
-        age_data[data_time][data_demographic] = np.loadtxt(path.join(data_dir,
-                                                                      data_time +
-                                                                      "_" +
-                                                                      data_demographic +
-                                                                      ".csv"),
-                                                                      dtype=int)
-        #invert all data for the female portion (negative barplots for all female values):
-        if data_demographic.startswith("f"):
-            age_data[data_time][data_demographic] *= -1
-
-#load migration and birth stats, also with scenarios
-for key in ("historical_ch","historical_au","low_ch","low_au","ref_ch","ref_au","high_ch","high_au"):
-    additional_stats[key] = np.rot90(np.fliplr(np.loadtxt(path.join(data_dir,key + ".stats"), dtype=int)))
-    additional_stats[key][2] *= -1
-    additional_stats[key][4] *= -1
 
 
 age_groups = [k for k in range(101)]
@@ -41,86 +20,96 @@ x_scatter = np.zeros(101)
 
 
 
-class Bevstat():
-    def __init__(self, age_data, additional_stats, first_recorded_year):
-        self.age_data = age_data
-        self.additional_stats = additional_stats
+class BevstatData():
+    #pop_data and everything derived from it, built once per process and shared by all sessions
+    def __init__(self, data_dir, first_recorded_year):
+        #population cube[scenario, year, demographic, age]: actual population counts 1971-2015 and scenarios 2016-2045
+        self.cube = bevstat_core.load_cube(data_dir)
+        #migration and birth stats, also with scenarios
+        self.additional_stats = bevstat_core.load_additional_stats(data_dir)
         self.first_recorded_year = first_recorded_year
-        self.labor_age_min = 18
-        self.labor_age_max = 67
-        self.radio_active = 1
-        self.age_groups = [group for group in range(101)]
-        self.age_data_source = dict()
+        self.indicators = bevstat_core.Indicators(self.cube, first_recorded_year)
+        self.years = self.cube.shape[1]
+        #band sums for every scenario, year and demographic are precomputed per age band level,
+        #switching levels swaps between ready-made sources
+        self.band_edges = [bevstat_core.band_edges(band) for band in bevstat_core.band_levels]
+        self.band_cubes = [bevstat_core.band_cube(self.cube, band_edges) for band_edges in self.band_edges]
+        self.band_snap = [bevstat_core.band_snap(band_edges) for band_edges in self.band_edges]
+        self.band_limits = [85000 * int(band_cube.max()) // int(self.cube.max()) for band_cube in self.band_cubes]
+        #the scenario columns of the stat plots are stacked once, switching scenarios only swaps references
+        self.stat_columns = [dict((origin, [np.hstack((self.additional_stats["historical_" + origin][num],
+                                                       self.additional_stats[scenario + "_" + origin][num]))
+                                            for num in range(1, 5)])
+                                  for origin in ("ch", "au"))
+                             for scenario in ("low", "ref", "high")]
         self.display_stats = dict()
-        self.additional_stats_source = dict()
-
-        self.underage_box = BoxAnnotation(top=self.labor_age_min, fill_alpha=0.15, fill_color='red')
-        self.laborage_box = BoxAnnotation(bottom=self.labor_age_min, top=self.labor_age_max, fill_alpha=0.15, fill_color='green')
-        self.retired_box = BoxAnnotation(bottom=self.labor_age_max, fill_alpha=0.15, fill_color='red')
-
-        self.births_box = BoxAnnotation(left=first_recorded_year,
-                                        right=first_recorded_year + 1,
-                                        line_width = 0.3,
-                                        line_color = "black",
-                                        line_alpha = 1,
-                                        fill_alpha=0.2,
-                                        fill_color='yellow')
-
-        self.migration_box = BoxAnnotation(left=first_recorded_year,
-                                           right=first_recorded_year + 1,
-                                           line_width=0.3,
-                                           line_color="black",
-                                           line_alpha=1,
-                                           fill_alpha=0.2,
-                                           fill_color='yellow')
-
-        self.dependency_ratio_textfield = PreText(text="", width=500)
-        self.total_population_textfield = PreText(text="", width=500)
-
         self.display_stats["ch"] = np.hstack((self.additional_stats["historical_ch"], self.additional_stats["ref_ch"]))
         self.display_stats["au"] = np.hstack((self.additional_stats["historical_au"], self.additional_stats["ref_au"]))
 
-        for data_demographic in ("m_ch", "m_au", "f_ch", "f_au"):
-            self.age_data_source[data_demographic] = ColumnDataSource(
-                data=dict(y=self.age_groups, display=self.age_data["historical"][data_demographic][0]))
+    def display_data(self, band_level, slider_value, radio_active):
+        #display rows in a new array, the sessions fill their own buffers in Bevstat.fill_display_buffer
+        display_data = np.array(self.band_cubes[band_level][radio_active, slider_value])
+        np.negative(display_data[2:], out=display_data[2:])
+        return display_data
 
-        self.historical_years = len(self.age_data["historical"]["m_ch"])
-        self.predicted_years = len(self.age_data["reference_prediction"]["m_ch"])
 
-        self.offset_slider = Slider(title="", value=0, start=0, end=self.historical_years + self.predicted_years -1,
-                                    step=1, sizing_mode="scale_height", orientation="horizontal")
-        #changing icons on the fly diesnt seem to work
-        #Bokeh Icons are removed with 0.12.4
-        #self.icon_arrow = Icon(icon_name="arrow-circle-up")
-        self.animate_button = Button(label="Animation", width=70)
+class Bevstat():
+    def __init__(self, data, doc):
+        #session state on top of the shared data, the models are looked up by name in the session's document
+        self.cube = data.cube
+        self.indicators = data.indicators
+        self.additional_stats = data.additional_stats
+        self.first_recorded_year = data.first_recorded_year
+        self.labor_age_min = 18
+        self.labor_age_max = 67
+        self.selected_ages = (self.labor_age_min, self.labor_age_max)
+        self.radio_active = 1
+        self.age_groups = [group for group in range(101)]
+        self.display_stats = data.display_stats
+        self.band_level = 0
+        self.band_edges = data.band_edges
+        self.band_cubes = data.band_cubes
+        self.band_snap = data.band_snap
+        self.band_limits = data.band_limits
+        #two sets of display rows per level used in turns, bokeh gets a different array object on every update
+        #and detects the change without a new array being allocated per event. display_buffer_index is the set
+        #the document holds, only the other one is ever filled and update_data swaps them after assigning it
+        self.display_buffers = [np.zeros((2, len(bevstat_core.demographics), band_cube.shape[3]), dtype=self.cube.dtype)
+                                for band_cube in self.band_cubes]
+        self.display_rows = [[tuple(display_buffer) for display_buffer in display_buffers]
+                             for display_buffers in self.display_buffers]
+        self.display_buffer_index = [1] * len(self.band_cubes)
+        self.stat_columns = data.stat_columns
+        self.years = data.years
+        self.derived_tables = dict()
+        self.pending_tables = bevstat_precompute.table_names()
+
+        model = lambda name: doc.select_one(dict(name=name))
+        self.plot = model("pyramid_plot")
+        self.pyramid_renderers = [doc.select(dict(name="pyramid_{}".format(band_level)))
+                                  for band_level in range(len(self.band_edges))]
+        self.age_data_source = [model("age_data_source_{}".format(band_level))
+                                for band_level in range(len(self.band_edges))]
+        self.underage_box = model("underage_box")
+        self.laborage_box = model("laborage_box")
+        self.retired_box = model("retired_box")
+        self.births_box = model("births_box")
+        self.migration_box = model("migration_box")
+        self.dependency_ratio_textfield = model("dependency_ratio_textfield")
+        self.total_population_textfield = model("total_population_textfield")
+        self.offset_slider = model("offset_slider")
+        self.animate_button = model("animate_button")
         self.animate_button.on_click(self.animation_button_click)
-
-        for origin in ("ch", "au"):
-            self.additional_stats_source[origin] = ColumnDataSource(data=dict(years=self.display_stats[origin][0] + 0.25,
-                                                                         births=self.display_stats[origin][1],
-                                                                         deaths=self.display_stats[origin][2],
-                                                                         immigration=self.display_stats[origin][3],
-                                                                         migration=self.display_stats[origin][4]))
+        self.additional_stats_source = dict((origin, model("additional_stats_source_" + origin))
+                                            for origin in ("ch", "au"))
+        self.precompute_status_textfield = model("precompute_status_textfield")
 
     def update_stat_plots(self, radio_active):
         self.radio_active = radio_active
 
-        for num, stat in enumerate(['births', 'deaths', 'immigration', 'migration'], 1):
-            if self.radio_active == 0:
-                self.additional_stats_source['ch'].data[stat] = np.hstack(
-                    (self.additional_stats["historical_ch"][num], self.additional_stats["low_ch"][num]))
-                self.additional_stats_source['au'].data[stat] = np.hstack(
-                    (self.additional_stats["historical_au"][num], self.additional_stats["low_au"][num]))
-            if self.radio_active == 1:
-                self.additional_stats_source['ch'].data[stat] = np.hstack(
-                    (self.additional_stats["historical_ch"][num], self.additional_stats["ref_ch"][num]))
-                self.additional_stats_source['au'].data[stat] = np.hstack(
-                    (self.additional_stats["historical_au"][num], self.additional_stats["ref_au"][num]))
-            if self.radio_active == 2:
-                self.additional_stats_source['ch'].data[stat] = np.hstack(
-                    (self.additional_stats["historical_ch"][num], self.additional_stats["high_ch"][num]))
-                self.additional_stats_source['au'].data[stat] = np.hstack(
-                    (self.additional_stats["historical_au"][num], self.additional_stats["high_au"][num]))
+        for origin in ("ch", "au"):
+            for num, stat in enumerate(['births', 'deaths', 'immigration', 'migration']):
+                self.additional_stats_source[origin].data[stat] = self.stat_columns[self.radio_active][origin][num]
 
         self.update_data(self.offset_slider.value)
 
@@ -133,19 +122,35 @@ class Bevstat():
             curdoc().remove_periodic_callback(self.button_animation)
 
     def button_animation(self):
-        if self.offset_slider.value < self.historical_years + self.predicted_years - 1 :
+        if self.offset_slider.value < self.years - 1:
             self.animate_button.label = "Stop"
             self.offset_slider.value += 1
         else:
             self.animate_button.label = "Animation"
             curdoc().remove_periodic_callback(self.button_animation)
             self.offset_slider.value = 0
-        self.update_data(self.offset_slider.value)
+        #the slider's on_change callback updates the data, a second update_data would send another
+        #identical keyframe message and restart the tween in the browser
+
 
+    def update_band_level(self, band_level):
+        self.band_level = band_level
+        for level, renderers in enumerate(self.pyramid_renderers):
+            for renderer in renderers:
+                renderer.visible = level == band_level
+        self.plot.x_range.update(start=-self.band_limits[band_level], end=self.band_limits[band_level])
+        self.update_dependency_box(*self.selected_ages)
+        #the bars of the level still hold the frame they showed when it was last visible (or the template's
+        #first year), they jump to the current frame instead of being tweened from that one
+        self.update_data(self.offset_slider.value, cut=True)
 
     def update_dependency_box(self, labor_age_min, labor_age_max):
-        self.labor_age_min = labor_age_min
-        self.labor_age_max = labor_age_max
+        self.selected_ages = (labor_age_min, labor_age_max)
+        #working and retirement age snap to the edges of the displayed age bands
+        band_edges = self.band_edges[self.band_level]
+        self.labor_age_min = min(self.band_snap[self.band_level][labor_age_min], band_edges[-2])
+        self.labor_age_max = max(self.band_snap[self.band_level][labor_age_max],
+                                 band_edges[band_edges.index(self.labor_age_min) + 1])
 
         self.underage_box.update(top=self.labor_age_min)
         self.laborage_box.update(bottom=self.labor_age_min, top=self.labor_age_max)
@@ -156,14 +161,21 @@ class Bevstat():
                                                         self.radio_active)
         self.update_dependency_text(*dependency_tuple)
 
+    def add_derived_table(self, name, table):
+        #pushed by the precompute scheduler, table is None if it could not be computed
+        self.pending_tables.remove(name)
+        if table is not None:
+            self.derived_tables[name] = table
+        self.update_precompute_status()
+
+    def update_precompute_status(self):
+        self.precompute_status_textfield.update(text="".join(
+            ["Still computing:"] + ["\n\t- " + bevstat_precompute.table_label(name) for name in self.pending_tables]
+            if self.pending_tables else []))
+
     @lru_cache(maxsize=256)
     def prepare_dependency_text(self, labor_age_min, labor_age_max, slider_value, radio_active):
-        display_data_total = self.age_data_source['m_ch'].data['display'] \
-                             + (-1 * self.age_data_source['f_ch'].data['display'])
-        dependency_ratio_minor = (sum(display_data_total[0:labor_age_min])) / sum(display_data_total[labor_age_min:])
-        dependency_ratio_major = (sum(display_data_total[labor_age_max:])) / sum(display_data_total[:labor_age_max])
-        dependency_ratio = dependency_ratio_minor + dependency_ratio_major
-        return dependency_ratio, dependency_ratio_minor, dependency_ratio_major
+        return self.indicators.dependency(radio_active, slider_value, labor_age_min, labor_age_max)
 
     def update_dependency_text(self, dep, dep_min, dep_maj):
         self.dependency_ratio_textfield.update(
@@ -178,10 +190,8 @@ class Bevstat():
 
     @lru_cache(maxsize=256)
     def prepare_population_text(self, slider_value, radio_active):
-        return sum(self.age_data_source['m_ch'].data['display']),\
-               sum(self.age_data_source['f_ch'].data['display']) * -1,\
-               sum(self.age_data_source['m_au'].data['display']),\
-               sum(self.age_data_source['f_au'].data['display']) * -1
+        m_ch_sum, m_au_sum, f_ch_sum, f_au_sum = self.indicators.population(radio_active, slider_value)
+        return m_ch_sum, f_ch_sum, m_au_sum, f_au_sum
 
     def update_population_text(self, m_ch_sum, f_ch_sum, m_au_sum, f_au_sum):
         self.total_population_textfield.update(text="Total population: {total_pop:,}\n"
@@ -200,29 +210,18 @@ class Bevstat():
             total_pop_f_au=f_au_sum))
 
     def get_new_display_data(self, slider_value, radio_active):
-        if slider_value < self.historical_years:
-            return self.age_data['historical']['m_ch'][slider_value],\
-                   self.age_data['historical']['m_au'][slider_value],\
-                   self.age_data['historical']['f_ch'][slider_value],\
-                   self.age_data['historical']['f_au'][slider_value]
-
-        elif slider_value >= self.historical_years and self.radio_active == 0:
-            return self.age_data['low_prediction']['m_ch'][slider_value - self.historical_years],\
-                   self.age_data['low_prediction']['m_au'][slider_value - self.historical_years],\
-                   self.age_data['low_prediction']['f_ch'][slider_value - self.historical_years],\
-                   self.age_data['low_prediction']['f_au'][slider_value - self.historical_years]
-
-        elif slider_value >= self.historical_years and self.radio_active == 1:
-            return self.age_data['reference_prediction']['m_ch'][slider_value - self.historical_years],\
-                   self.age_data['reference_prediction']['m_au'][slider_value - self.historical_years],\
-                   self.age_data['reference_prediction']['f_ch'][slider_value - self.historical_years],\
-                   self.age_data['reference_prediction']['f_au'][slider_value - self.historical_years]
-
-        elif slider_value >= self.historical_years and self.radio_active == 2:
-            return self.age_data['high_prediction']['m_ch'][slider_value - self.historical_years],\
-                   self.age_data['high_prediction']['m_au'][slider_value - self.historical_years],\
-                   self.age_data['high_prediction']['f_ch'][slider_value - self.historical_years],\
-                   self.age_data['high_prediction']['f_au'][slider_value - self.historical_years]
+        #fills the spare buffer only, calling this without assigning the result leaves the document untouched
+        return self.fill_display_buffer(self.band_level, slider_value, radio_active)
+
+    def fill_display_buffer(self, band_level, slider_value, radio_active):
+        #historical years are part of every scenario, the radio buttons index the scenario axis
+        band_cube = self.band_cubes[band_level]
+        spare = self.display_buffer_index[band_level] ^ 1
+        display_buffer = self.display_buffers[band_level][spare]
+        np.copyto(display_buffer[:2], band_cube[radio_active, slider_value, :2])
+        #invert all data for the female portion (negative barplots for all female values):
+        np.negative(band_cube[radio_active, slider_value, 2:], out=display_buffer[2:])
+        return self.display_rows[band_level][spare]
 
 
     def update_current_year_box(self, slider_value):
@@ -231,11 +230,13 @@ class Bevstat():
                        right=self.first_recorded_year + slider_value + 1)
 
 
-    def update_data(self, slider_value):
-        self.age_data_source['m_ch'].data['display'], \
-        self.age_data_source['m_au'].data['display'], \
-        self.age_data_source['f_ch'].data['display'], \
-        self.age_data_source['f_au'].data['display'] = self.get_new_display_data(self.offset_slider.value, self.radio_active)
+    def update_data(self, slider_value, cut=False):
+        display_rows = self.get_new_display_data(self.offset_slider.value, self.radio_active)
+        #a cut sets the rendered columns along with the keyframes, the browser has nothing left to tween
+        self.age_data_source[self.band_level].data.update(bevstat_tween.tween_data(display_rows) if cut
+                                                          else dict(zip(bevstat_tween.keyframe_columns, display_rows)))
+        #the document holds the spare buffer now
+        self.display_buffer_index[self.band_level] ^= 1
         poptext_tuple = self.prepare_population_text(self.offset_slider.value, self.radio_active)
         self.update_population_text(*poptext_tuple)
         deptext_tuple = self.prepare_dependency_text(self.labor_age_min,
@@ -244,133 +245,245 @@ class Bevstat():
                                                  self.radio_active)
         self.update_dependency_text(*deptext_tuple)
         self.update_current_year_box(self.offset_slider.value)
-        plot.title.text = "Total resident population (Switzerland): {}".format(str(self.first_recorded_year + self.offset_slider.value))
+        self.plot.title.text = "Total resident population (Switzerland): {}".format(str(self.first_recorded_year + self.offset_slider.value))
 
 
 
-
-bevstat = Bevstat(age_data, additional_stats, 1971)
+data = bevstat_template.process_cached("bevstat_en.data", data_dir,
+                                       lambda: BevstatData(data_dir, bevstat_core.first_recorded_year))
+#derived tables are shared by all scripts served by the process, started before the first session renders
+precompute = bevstat_template.process_cached("precompute", data_dir,
+                                             lambda: bevstat_precompute.Scheduler(data.indicators, data_dir))
 
 ###############################################################################################
 ###############################################################################################
 
-hovertool_births = HoverTool(tooltips=[("Birth surplus", "@y"),("Year","@x")])
-hovertool_migration = HoverTool(tooltips=[("Net migration", "@y"),("Year","@x")])
-
-plot = figure(plot_height=400, plot_width=600, title="Total resident population (Switzerland): 2010",
-              tools=["save", "box_select"],
-              x_range=[-85000, 85000],
-              y_range=[0, 101])
-
-plot_birth = figure(plot_height=400, plot_width=600, title="Birth surplus",
-              tools=[hovertool_births],
-              x_range=[bevstat.display_stats["ch"][0][0],bevstat.display_stats["ch"][0][-1]],
-              y_range=[-100000, 100000])
-
-plot_migration = figure(plot_height=400, plot_width=600, title="Net migration",
-              tools=[hovertool_migration],
-              x_range=[bevstat.display_stats["ch"][0][0],bevstat.display_stats["ch"][0][-1]],
-              y_range=[-180000, 180000])
-
-
-for stat_type in ("births","deaths"):
-    for key in bevstat.additional_stats_source:
-        vbar_color = "blue" if "ch" in key else "red"
-        plot_birth.vbar(x='years',
-                        top=stat_type,
-                        source=bevstat.additional_stats_source[key],
-                        bottom=0,
-                        width=0.5,
-                        alpha=0.1,
-                        color=vbar_color)
-
-
-hovertool_births.renderers.append(plot_birth.line(x=np.array(bevstat.display_stats["ch"][0]),
-                     y=bevstat.display_stats["ch"][1]+bevstat.display_stats["ch"][2],
-                     line_width=4,
-                     color="blue",
-                     legend="Birth surplus (Swiss)"))
-
-hovertool_births.renderers.append(plot_birth.line(x=np.array(bevstat.display_stats["au"][0]),
-                     y=bevstat.display_stats["au"][1]+bevstat.display_stats["au"][2],
-                     line_width=4,
-                     color="red",
-                     legend="Birth surplus (Foreign)"))
-
-
-for stat_type in ("migration","immigration"):
-    for key in bevstat.additional_stats_source:
-        vbar_color = "blue" if "ch" in key else "red"
-        plot_migration.vbar(x='years',
-                        top=stat_type,
-                        source=bevstat.additional_stats_source[key],
-                        bottom=0,
-                        width=0.5,
-                        alpha=0.1,
-                        color=vbar_color)
-
-
-hovertool_migration.renderers.append(plot_migration.line(x=np.array(bevstat.display_stats["ch"][0]),
-                     y=bevstat.display_stats["ch"][3]+bevstat.display_stats["ch"][4],
-                     line_width=4,
-                     color="blue",
-                     legend="Net migration (Swiss)"))
+def build_document(doc):
+    #static parts of the document and its data for the first year of the reference scenario,
+    #built once per process, every session starts from a copy
+    labor_age_min, labor_age_max = bevstat_core.default_window
+    first_recorded_year = data.first_recorded_year
+
+    underage_box = BoxAnnotation(top=labor_age_min, fill_alpha=0.15, fill_color='red', name="underage_box")
+    laborage_box = BoxAnnotation(bottom=labor_age_min, top=labor_age_max, fill_alpha=0.15, fill_color='green', name="laborage_box")
+    retired_box = BoxAnnotation(bottom=labor_age_max, fill_alpha=0.15, fill_color='red', name="retired_box")
+
+    births_box = BoxAnnotation(left=first_recorded_year,
+                               right=first_recorded_year + 1,
+                               line_width = 0.3,
+                               line_color = "black",
+                               line_alpha = 1,
+                               fill_alpha=0.2,
+                               fill_color='yellow',
+                               name="births_box")
+
+    migration_box = BoxAnnotation(left=first_recorded_year,
+                                  right=first_recorded_year + 1,
+                                  line_width=0.3,
+                                  line_color="black",
+                                  line_alpha=1,
+                                  fill_alpha=0.2,
+                                  fill_color='yellow',
+                                  name="migration_box")
+
+    dependency_ratio_textfield = PreText(text="", width=500, name="dependency_ratio_textfield")
+    total_population_textfield = PreText(text="", width=500, name="total_population_textfield")
+    precompute_status_textfield = PreText(text="", width=500, name="precompute_status_textfield")
+
+    #one source per band level, the server only updates the keyframe columns of the active one,
+    #the bars are tweened towards them in the browser
+    age_data_source = []
+    for band_level, band_edges in enumerate(data.band_edges):
+        age_data_source.append(ColumnDataSource(data=dict(
+            y=[(start + end - 1) / 2 for start, end in zip(band_edges, band_edges[1:])],
+            height=[end - start - 0.5 for start, end in zip(band_edges, band_edges[1:])],
+            **bevstat_tween.tween_data(data.display_data(band_level, 0, 1))),
+            name="age_data_source_{}".format(band_level)))
+
+    m_ch_sum, m_au_sum, f_ch_sum, f_au_sum = data.indicators.population(1, 0)
+    tween_label_source = ColumnDataSource(data=dict(x=[60], y=[335], prefix=["Total population: "],
+                                                    text=["Total population: {:,}".format(m_ch_sum + f_ch_sum)]))
+    tween_label = LabelSet(x='x', y='y', text='text', source=tween_label_source,
+                           x_units='screen', y_units='screen', text_font_size="10pt")
+    for band_source in age_data_source:
+        band_source.js_on_change('data', bevstat_tween.tween_callback(band_source, tween_label_source))
+
+    offset_slider = Slider(title="", value=0, start=0, end=data.years - 1,
+                           step=1, sizing_mode="scale_height", orientation="horizontal", name="offset_slider")
+    #changing icons on the fly diesnt seem to work
+    #Bokeh Icons are removed with 0.12.4
+    #self.icon_arrow = Icon(icon_name="arrow-circle-up")
+    animate_button = Button(label="Animation", width=70, name="animate_button")
+
+    additional_stats_source = dict()
+    for origin in ("ch", "au"):
+        additional_stats_source[origin] = ColumnDataSource(data=dict(years=data.display_stats[origin][0] + 0.25,
+                                                                     births=data.display_stats[origin][1],
+                                                                     deaths=data.display_stats[origin][2],
+                                                                     immigration=data.display_stats[origin][3],
+                                                                     migration=data.display_stats[origin][4]),
+                                                           name="additional_stats_source_" + origin)
+
+    hovertool_births = HoverTool(tooltips=[("Birth surplus", "@y"),("Year","@x")])
+    hovertool_migration = HoverTool(tooltips=[("Net migration", "@y"),("Year","@x")])
+
+    plot = figure(plot_height=400, plot_width=600, title="Total resident population (Switzerland): 2010",
+                  tools=["save", "box_select"],
+                  x_range=[-85000, 85000],
+                  y_range=[0, 101],
+                  name="pyramid_plot")
+
+    plot_birth = figure(plot_height=400, plot_width=600, title="Birth surplus",
+                  tools=[hovertool_births],
+                  x_range=[data.display_stats["ch"][0][0],data.display_stats["ch"][0][-1]],
+                  y_range=[-100000, 100000])
+
+    plot_migration = figure(plot_height=400, plot_width=600, title="Net migration",
+                  tools=[hovertool_migration],
+                  x_range=[data.display_stats["ch"][0][0],data.display_stats["ch"][0][-1]],
+                  y_range=[-180000, 180000])
+
+
+    for stat_type in ("births","deaths"):
+        for key in additional_stats_source:
+            vbar_color = "blue" if "ch" in key else "red"
+            plot_birth.vbar(x='years',
+                            top=stat_type,
+                            source=additional_stats_source[key],
+                            bottom=0,
+                            width=0.5,
+                            alpha=0.1,
+                            color=vbar_color)
+
+
+    hovertool_births.renderers.append(plot_birth.line(x=np.array(data.display_stats["ch"][0]),
+                         y=data.display_stats["ch"][1]+data.display_stats["ch"][2],
+                         line_width=4,
+                         color="blue",
+                         legend="Birth surplus (Swiss)"))
+
+    hovertool_births.renderers.append(plot_birth.line(x=np.array(data.display_stats["au"][0]),
+                         y=data.display_stats["au"][1]+data.display_stats["au"][2],
+                         line_width=4,
+                         color="red",
+                         legend="Birth surplus (Foreign)"))
+
+
+    for stat_type in ("migration","immigration"):
+        for key in additional_stats_source:
+            vbar_color = "blue" if "ch" in key else "red"
+            plot_migration.vbar(x='years',
+                            top=stat_type,
+                            source=additional_stats_source[key],
+                            bottom=0,
+                            width=0.5,
+                            alpha=0.1,
+                            color=vbar_color)
+
+
+    hovertool_migration.renderers.append(plot_migration.line(x=np.array(data.display_stats["ch"][0]),
+                         y=data.display_stats["ch"][3]+data.display_stats["ch"][4],
+                         line_width=4,
+                         color="blue",
+                         legend="Net migration (Swiss)"))
+
+    hovertool_migration.renderers.append(plot_migration.line(x=np.array(data.display_stats["ch"][0]),
+                         y=data.display_stats["au"][3]+data.display_stats["au"][4],
+                         line_width=4,
+                         color="red",
+                         legend="Net migration (Foreign)"))
+
+    #only scatterplots can be selectec with boxselect
+    #invisible scatter along x=0
+    plot.scatter(x=x_scatter, y=age_groups, size=0, name="age_scatter")
+
+    plot.legend.location = "top_right"
+    plot.legend.background_fill_color = "white"
+    plot.legend.background_fill_alpha = 0.8
+    plot.legend.border_line_color = "black"
+    plot.legend.border_line_width = 2
+
+    plot_birth.legend.location = "bottom_left"
+    plot_migration.legend.location = "bottom_left"
+
+
+    #dotted line separating male / female
+    m_f_separator = Span(location=0, dimension='height', line_dash='dashed', line_color='black', line_width=1)
+
+    annotation_female = Label(x=85, y=35, x_units='screen', y_units='screen',
+                     text='Female', render_mode='css',
+                     border_line_color='black', border_line_alpha=0.4,
+                     background_fill_color='white', background_fill_alpha=0.7)
+
+    annotation_male = Label(x=495, y=35, x_units='screen', y_units='screen',
+                     text='Male', render_mode='css',
+                     border_line_color='black', border_line_alpha=0.4,
+                     background_fill_color='white', background_fill_alpha=0.7)
+
+    plot.yaxis.axis_label = "Age"
+    plot.xaxis.formatter = formatters.NumeralTickFormatter(format="(0,0)")
+
+    plot_birth.yaxis.axis_label = "deaths (-)  births (+)"
+    plot_birth.yaxis.formatter = formatters.PrintfTickFormatter(format="%d")
+    plot_birth.xgrid.minor_grid_line_alpha = 0.5
+
+    plot_migration.yaxis.axis_label = "emigration (-)  immigration (+)"
+    plot_migration.yaxis.formatter = formatters.PrintfTickFormatter(format="%d")
+    plot_migration.xgrid.minor_grid_line_alpha = 0.5
+
+    #throttling doesnt' work with bokeh server, massive CPU-spike when
+    #toying with slider
+
+    prediction_radio_group = RadioGroup(
+            labels=["Prediction scenario: \"low\"", "Referencescenario", "Prediction scenario \"high\""], active=1,
+            name="prediction_radio_group")
 
-hovertool_migration.renderers.append(plot_migration.line(x=np.array(bevstat.display_stats["ch"][0]),
-                     y=bevstat.display_stats["au"][3]+bevstat.display_stats["au"][4],
-                     line_width=4,
-                     color="red",
-                     legend="Net migration (Foreign)"))
 
-#only scatterplots can be selectec with boxselect
-#invisible scatter along x=0
-scatter = plot.scatter(x=x_scatter, y=age_groups, size=0)
+    #one set of bars per age band level, only the first level is visible
+    for band_level, band_source in enumerate(age_data_source):
+        visible = band_level == 0
+        name = "pyramid_{}".format(band_level)
+        plot.hbar(right='m_ch', y='y', source=band_source, height='height', line_width=3, line_alpha=0.4, color="blue", legend="Swiss", visible=visible, name=name)
+        plot.hbar(right='m_au', y='y', source=band_source, height='height', line_width=3, line_alpha=0.4, color="red", legend="Foreign", visible=visible, name=name)
+        plot.hbar(right='f_ch', y='y', source=band_source, height='height', line_width=3, line_alpha=0.4, color="blue", visible=visible, name=name)
+        plot.hbar(right='f_au', y='y', source=band_source, height='height', line_width=3, line_alpha=0.4, color="red", visible=visible, name=name)
+
+    #one button per entry of bevstat_core.band_levels, custom bands are the life stages
+    band_labels = [("1 year" if band == 1 else "{} years".format(band))
+                   if isinstance(band, int) else "Life stages"
+                   for band in bevstat_core.band_levels]
+    band_radio_group = RadioButtonGroup(labels=band_labels, active=0, name="band_radio_group")
 
-plot.legend.location = "top_right"
-plot.legend.background_fill_color = "white"
-plot.legend.background_fill_alpha = 0.8
-plot.legend.border_line_color = "black"
-plot.legend.border_line_width = 2
+    inputs = widgetbox(dependency_ratio_textfield, total_population_textfield, prediction_radio_group,
+                       band_radio_group, width=600)
 
-plot_birth.legend.location = "bottom_left"
-plot_migration.legend.location = "bottom_left"
+    doc.add_root(column(row(plot, column(inputs,offset_slider, animate_button, precompute_status_textfield)),
+                        row(plot_birth, plot_migration)))
+    doc.title = "Swiss resident population history"
 
+    for my_plot in [plot_birth, plot_migration]:
+        my_plot.toolbar.logo = None
 
-#dotted line separating male / female
-m_f_separator = Span(location=0, dimension='height', line_dash='dashed', line_color='black', line_width=1)
+    for my_layout in [underage_box, laborage_box, retired_box, m_f_separator, annotation_male, annotation_female,
+                      tween_label]:
+        plot.add_layout(my_layout)
 
-annotation_female = Label(x=85, y=35, x_units='screen', y_units='screen',
-                 text='Female', render_mode='css',
-                 border_line_color='black', border_line_alpha=0.4,
-                 background_fill_color='white', background_fill_alpha=0.7)
+    plot_birth.add_layout(births_box)
+    plot_migration.add_layout(migration_box)
 
-annotation_male = Label(x=495, y=35, x_units='screen', y_units='screen',
-                 text='Male', render_mode='css',
-                 border_line_color='black', border_line_alpha=0.4,
-                 background_fill_color='white', background_fill_alpha=0.7)
+    #initial texts go through the same code as the session updates
+    template = Bevstat(data, doc)
+    template.update_dependency_text(*template.prepare_dependency_text(labor_age_min, labor_age_max, 0, 1))
+    template.update_population_text(*template.prepare_population_text(0, 1))
+    template.update_precompute_status()
 
-plot.yaxis.axis_label = "Age"
-plot.xaxis.formatter = formatters.NumeralTickFormatter(format="(0,0)")
 
-plot_birth.yaxis.axis_label = "deaths (-)  births (+)"
-plot_birth.yaxis.formatter = formatters.PrintfTickFormatter(format="%d")
-plot_birth.xgrid.minor_grid_line_alpha = 0.5
+bevstat_template.session_document(curdoc(), "bevstat_en", data_dir, build_document)
+bevstat = Bevstat(data, curdoc())
 
-plot_migration.yaxis.axis_label = "emigration (-)  immigration (+)"
-plot_migration.yaxis.formatter = formatters.PrintfTickFormatter(format="%d")
-plot_migration.xgrid.minor_grid_line_alpha = 0.5
-
-#throttling doesnt' work with bokeh server, massive CPU-spike when
-#toying with slider
-
-prediction_radio_group = RadioGroup(
-        labels=["Prediction scenario: \"low\"", "Referencescenario", "Prediction scenario \"high\""], active=1)
-
-
-plot.hbar(right='display', y='y', source=bevstat.age_data_source["m_ch"], height=0.5, line_width=3, line_alpha=0.4, color="blue", legend="Swiss")
-plot.hbar(right='display', y='y', source=bevstat.age_data_source["m_au"], height=0.5, line_width=3, line_alpha=0.4, color="red", legend="Foreign")
-plot.hbar(right='display', y='y', source=bevstat.age_data_source["f_ch"], height=0.5, line_width=3, line_alpha=0.4, color="blue")
-plot.hbar(right='display', y='y', source=bevstat.age_data_source["f_au"], height=0.5, line_width=3, line_alpha=0.4, color="red")
+prediction_radio_group = curdoc().select_one(dict(name="prediction_radio_group"))
+band_radio_group = curdoc().select_one(dict(name="band_radio_group"))
+scatter = curdoc().select_one(dict(name="age_scatter"))
 
 
 offset_changed = lambda attr,old,new: bevstat.update_data(new)
@@ -379,27 +492,13 @@ bevstat.offset_slider.on_change('value', offset_changed)
 radio_group_changed = lambda attr: bevstat.update_stat_plots(prediction_radio_group.active)
 prediction_radio_group.on_click(radio_group_changed)
 
+band_group_changed = lambda attr: bevstat.update_band_level(band_radio_group.active)
+band_radio_group.on_click(band_group_changed)
+
 scatter_changed = lambda attr,old,new: bevstat.update_dependency_box(min(new['1d']['indices']),
                                                                      max(new['1d']['indices']))
 scatter.data_source.on_change('selected', scatter_changed)
 
-bevstat.update_dependency_text(*bevstat.prepare_dependency_text(bevstat.labor_age_min,
-                                                               bevstat.labor_age_max,
-                                                               0,
-                                                               1))
-bevstat.update_population_text(*bevstat.prepare_population_text(0, 1))
-
-inputs = widgetbox(bevstat.dependency_ratio_textfield, bevstat.total_population_textfield, prediction_radio_group, width=600)
-
-curdoc().add_root(column(row(plot, column(inputs,bevstat.offset_slider, bevstat.animate_button)),
-                         row(plot_birth, plot_migration)))
-curdoc().title = "Swiss resident population history"
-
-for my_plot in [plot_birth, plot_migration]:
-    my_plot.toolbar.logo = None
-
-for my_layout in [bevstat.underage_box, bevstat.laborage_box, bevstat.retired_box, m_f_separator, annotation_male, annotation_female]:
-    plot.add_layout(my_layout)
-
-plot_birth.add_layout(bevstat.births_box)
-plot_migration.add_layout(bevstat.migration_box)
+#tables that are ready are added right away, the others are pushed by the scheduler's worker
+for table_name in bevstat_precompute.table_names():
+    precompute.subscribe(curdoc(), table_name, bevstat.add_derived_table)
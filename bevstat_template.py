@@ -0,0 +1,37 @@
+import json
+
+from bokeh.document import Document
+
+import bevstat_core
+
+
+#"bokeh serve" executes the app script for every new session. loading pop_data, the band cubes and
+#creating the ~250 models of the layout used to happen per session, now they happen once per process:
+#the data is shared by all sessions, the initial document is serialized once and every session gets
+#its own copy by deserializing it, the script only wires callbacks and session state to the copy
+
+#key -> (data version, value), a changed pop_data replaces the entry of its key
+_process_cache = dict()
+
+
+def process_cached(key, data_dir, factory):
+    #factory() runs once per process, key and version of data_dir
+    version = bevstat_core.data_version(data_dir)
+    cached = _process_cache.get(key)
+    if cached is None or cached[0] != version:
+        cached = _process_cache[key] = (version, factory())
+    return cached[1]
+
+
+def _render_template(build_document):
+    document = Document()
+    build_document(document)
+    return document.to_json_string()
+
+
+def session_document(doc, key, data_dir, build_document):
+    #build_document(doc) adds the roots and initial data, models the session needs are found by name
+    template = process_cached(key + ".document", data_dir, lambda: _render_template(build_document))
+    #the json is parsed per session, deserialized models must not share lists with the template
+    doc.replace_with_json(json.loads(template))
+    return doc
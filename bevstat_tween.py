@@ -0,0 +1,73 @@
+from bokeh.models import CustomJS
+
+import bevstat_core
+
+
+#client side transitions between year frames:
+#the server only sends the "<demographic>_keyframe" columns, the browser interpolates the rendered
+#"<demographic>" columns (and the population label) towards them with requestAnimationFrame.
+#rendered columns are mutated in place and only emit "change", so nothing is synced back to the server
+
+tween_duration = 180
+keyframe_columns = [data_demographic + "_keyframe" for data_demographic in bevstat_core.demographics]
+
+tween_code = """
+var demographics = %(demographics)s;
+var duration = %(duration)d;
+var state = source._tween_state || (source._tween_state = {frame: null});
+if (state.frame !== null) {
+    cancelAnimationFrame(state.frame);
+}
+
+var from = {};
+for (var k = 0; k < demographics.length; k++) {
+    from[demographics[k]] = Array.prototype.slice.call(source.data[demographics[k]]);
+}
+var start = null;
+
+function step(timestamp) {
+    if (start === null) {
+        start = timestamp;
+    }
+    var t = Math.min((timestamp - start) / duration, 1);
+    var eased = t * (2 - t);
+    var total = 0;
+    for (var k = 0; k < demographics.length; k++) {
+        var demographic = demographics[k];
+        var display = source.data[demographic];
+        var target = source.data[demographic + "_keyframe"];
+        var origin = from[demographic];
+        for (var i = 0; i < display.length; i++) {
+            display[i] = origin[i] + (target[i] - origin[i]) * eased;
+        }
+        //"ch" counts include the foreign population, female values are negative
+        if (demographic === "m_ch" || demographic === "f_ch") {
+            for (var i = 0; i < display.length; i++) {
+                total += Math.abs(display[i]);
+            }
+        }
+    }
+    source.change.emit();
+    label.data.text[0] = label.data.prefix[0] + Math.round(total).toLocaleString("en-US");
+    label.change.emit();
+    state.frame = t < 1 ? requestAnimationFrame(step) : null;
+}
+
+state.frame = requestAnimationFrame(step);
+""" % dict(demographics="[" + ", ".join('"%s"' % demographic for demographic in bevstat_core.demographics) + "]",
+           duration=tween_duration)
+
+
+def tween_data(display_data):
+    #initial data of the rendered source, keyframe and rendered columns start out equal
+    data = dict()
+    for data_demographic, keyframe_column, display_row in zip(bevstat_core.demographics, keyframe_columns,
+                                                              display_data):
+        data[data_demographic] = display_row.tolist()
+        data[keyframe_column] = display_row
+    return data
+
+
+def tween_callback(source, label_source):
+    #attach with source.js_on_change('data', ...), fires when the server changes the keyframe columns
+    return CustomJS(args=dict(source=source, label=label_source), code=tween_code)
@@ -0,0 +1 @@
+#keeps the repository root importable for the tests, the app modules are not an installed package
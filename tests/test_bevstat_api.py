@@ -0,0 +1,173 @@
+import json
+import tracemalloc
+from urllib.parse import urlencode
+
+import numpy as np
+import pytest
+from tornado import web
+from tornado.testing import AsyncHTTPTestCase
+
+import bevstat_api
+import bevstat_core
+
+
+@pytest.fixture(scope="module")
+def indicators():
+    return bevstat_core.Indicators(bevstat_core.load_cube(), version="test")
+
+
+def test_parse_query_defaults(indicators):
+    scenario_index, year_index, age_min, age_max, format_ = bevstat_api.parse_query(indicators)
+    assert scenario_index.tolist() == [0, 1, 2]
+    assert year_index.tolist() == list(range(indicators.years))
+    assert (age_min.tolist(), age_max.tolist()) == ([18], [67])
+    assert format_ == "json"
+
+
+def test_parse_query_ranges(indicators):
+    scenario_index, year_index, age_min, age_max, format_ = bevstat_api.parse_query(
+        indicators, years="1971,2030-2032", scenarios_="high,low", windows="20-65,0-101", format_="csv")
+    assert scenario_index.tolist() == [2, 0]
+    assert (year_index + indicators.first_recorded_year).tolist() == [1971, 2030, 2031, 2032]
+    assert (age_min.tolist(), age_max.tolist()) == ([20, 0], [65, 101])
+
+
+@pytest.mark.parametrize("query, message", [
+    (dict(years="1900"), "years must lie within"),
+    (dict(years="2030-2020"), "years must lie within"),
+    (dict(years="0-999999999"), "years must lie within"),
+    (dict(years="abc"), "malformed query"),
+    (dict(years="2030,2030"), "must not overlap"),
+    (dict(years="2040-2045,1971-2045"), "must not overlap"),
+    (dict(scenarios_="foo"), "unknown scenarios foo"),
+    (dict(scenarios_="low,reference,low"), "must not repeat"),
+    (dict(windows="67-18"), "age windows"),
+    (dict(windows="0-102"), "age windows"),
+    (dict(format_="xml"), "format must be json or csv"),
+])
+def test_parse_query_errors(indicators, query, message):
+    with pytest.raises(bevstat_api.QueryError, match=message) as error:
+        bevstat_api.parse_query(indicators, **query)
+    assert error.value.status_code == 400
+
+
+def test_parse_query_too_large(indicators):
+    with pytest.raises(bevstat_api.QueryTooLarge) as error:
+        bevstat_api.parse_query(indicators, windows=["0-101"] * 10000)
+    assert error.value.status_code == 413
+
+
+def test_evaluate_matches_point_indicators(indicators):
+    flat, years = bevstat_core.load_flat_cube()
+    scenario_index, year_index = np.arange(3), np.array([0, 44, 45, 74])
+    age_min, age_max = np.array([0, 18, 20, 65]), np.array([101, 67, 65, 100])
+    result = indicators.evaluate(scenario_index, year_index, age_min, age_max)
+    for s, scenario in enumerate(scenario_index):
+        for y, year in enumerate(year_index):
+            for w in range(len(age_min)):
+                expected = bevstat_core.point_indicators(flat, years, scenario, year, age_min[w], age_max[w])
+                for column in bevstat_core.columns:
+                    assert result[column][s, y, w] == pytest.approx(expected[column]) \
+                        if isinstance(expected[column], float) else result[column][s, y, w] == expected[column]
+
+
+def test_evaluate_memory_at_row_cap(indicators):
+    #a query at the cap allocates output sized arrays only, measured at about 48 bytes per row
+    windows = ["{}-{}".format(age_min, age_max) for age_min in range(101) for age_max in range(age_min + 1, 102)]
+    query = bevstat_api.parse_query(indicators, windows=windows[:bevstat_api.max_rows // (3 * indicators.years)])
+    rows = query[0].size * query[1].size * query[2].size
+    assert rows > 0.95 * bevstat_api.max_rows
+    assert evaluate_peak_memory(indicators, *query[:4]) < 64 * rows
+
+
+def test_evaluate_memory_of_repeated_pairs(indicators):
+    #one window per (scenario, year) pair is the worst case, about 96 bytes per row.
+    #copying the prefix sums of every pair used to cost about 4 KB per row
+    scenario_index = np.repeat(np.arange(3), 100)
+    year_index = np.arange(indicators.years)
+    assert evaluate_peak_memory(indicators, scenario_index, year_index, np.array([18]), np.array([67])) \
+        < 128 * scenario_index.size * year_index.size
+
+
+def evaluate_peak_memory(indicators, *query):
+    #the result is kept alive until the peak is read
+    tracemalloc.start()
+    try:
+        result = indicators.evaluate(*query)
+        return tracemalloc.get_traced_memory()[1] if result else None
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("format_", ["json", "csv"])
+def test_render_chunks_independent_of_chunk_size(indicators, monkeypatch, format_):
+    result = indicators.evaluate(*bevstat_api.parse_query(indicators, years="2000-2010", windows="18-65,20-67")[:4])
+    body = "".join(bevstat_api.render_chunks(result, format_, "test"))
+    monkeypatch.setattr(bevstat_api, "chunk_rows", 7)
+    chunks = list(bevstat_api.render_chunks(result, format_, "test"))
+    assert len(chunks) > 3
+    assert "".join(chunks) == body
+    if format_ == "json":
+        assert len(json.loads(body)["rows"]) == 3 * 11 * 2
+
+
+def test_response_cache_is_bounded_by_bytes():
+    cache = bevstat_api.ResponseCache(max_bytes=10)
+    cache.put("a", b"12345")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"12345"
+    cache.put("c", b"123")
+    assert list(cache.bodies) == ["a", "c"] and cache.nbytes == 8
+    cache.put("too large", b"x" * 11)
+    assert cache.get("too large") is None
+
+
+class IndicatorHandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return web.Application(bevstat_api.make_handlers())
+
+    def get(self, headers=None, **query):
+        return self.fetch("/api/indicators?" + urlencode(query), headers=headers)
+
+    def test_json(self):
+        response = self.get(years="2030", scenarios="reference")
+        assert response.code == 200
+        assert response.headers["Content-Type"].startswith("application/json")
+        body = json.loads(response.body.decode())
+        assert body["columns"] == list(bevstat_core.columns)
+        assert body["rows"][0][:4] == ["reference", 2030, 18, 67]
+
+    def test_csv(self):
+        response = self.get(years="2030-2031", format="csv")
+        assert response.headers["Content-Type"].startswith("text/csv")
+        lines = response.body.decode().splitlines()
+        assert lines[0] == ",".join(bevstat_core.columns)
+        assert len(lines) == 1 + 3 * 2
+
+    def test_etag(self):
+        response = self.get(years="2030")
+        etag = response.headers["Etag"]
+        assert self.get(years="2030", headers={"If-None-Match": etag}).code == 304
+        assert self.get(years="2031", headers={"If-None-Match": etag}).code == 200
+        #the same normalized query sent as a POST body has the same ETag
+        post = self.fetch("/api/indicators", method="POST", body=json.dumps(dict(years=[2030])))
+        assert post.headers["Etag"] == etag
+        assert post.body == response.body
+
+    def test_streamed_response_matches_cached(self):
+        cached = self.get(years="1971-2045", windows="18-65,20-67")
+        bevstat_api.stream_threshold, threshold = 10, bevstat_api.stream_threshold
+        try:
+            streamed = self.get(years="1971-2045", windows="18-65,20-67")
+        finally:
+            bevstat_api.stream_threshold = threshold
+        assert streamed.body == cached.body
+
+    def test_errors_are_json(self):
+        for query, code in ((dict(years="1900"), 400), (dict(windows="67-18"), 400),
+                            (dict(format="xml"), 400), (dict(windows=",".join(["0-101"] * 6000)), 413)):
+            response = self.get(**query)
+            assert response.code == code
+            assert "error" in json.loads(response.body.decode())
+        response = self.fetch("/api/indicators", method="POST", body="[")
+        assert json.loads(response.body.decode()) == dict(error="request body is not valid JSON")
@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+import pytest
+
+import bevstat_precompute
+
+
+class RecordingDocument():
+    #stands in for a session document, next tick callbacks are collected instead of run by an event loop
+    def __init__(self):
+        self.next_tick_callbacks = []
+
+    def add_next_tick_callback(self, callback):
+        self.next_tick_callbacks.append(callback)
+
+
+def drain():
+    #the worker runs the jobs in order, a no-op finishing means every earlier table is done
+    bevstat_precompute._executor.submit(lambda: None).result()
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    (tmp_path / "population.csv").write_text("1\n")
+    return str(tmp_path)
+
+
+@pytest.fixture
+def blocked_worker():
+    #holds the worker until release.set(), tables stay pending meanwhile
+    release = threading.Event()
+    bevstat_precompute._executor.submit(release.wait)
+    yield release
+    release.set()
+    drain()
+
+
+def counting_tables(calls, names_and_priorities):
+    def compute(name, indicators):
+        calls.append(name)
+        return np.arange(3) + len(calls)
+    return dict((name, (priority, "", lambda indicators, name=name: compute(name, indicators)))
+                for name, priority in names_and_priorities)
+
+
+def test_priority_order(data_dir, blocked_worker):
+    calls = []
+    tables = counting_tables(calls, [("late", 2), ("first", 0), ("second", 1)])
+    bevstat_precompute.Scheduler(None, data_dir, tables)
+    blocked_worker.set()
+    drain()
+    assert calls == ["first", "second", "late"]
+
+
+def test_cache_keyed_by_data_version(data_dir, tmp_path):
+    calls = []
+    tables = counting_tables(calls, [("table", 0)])
+    scheduler = bevstat_precompute.Scheduler(None, data_dir, tables)
+    drain()
+    assert calls == ["table"]
+    assert (tmp_path / ".derived-{}-table.npy".format(scheduler.version)).exists()
+
+    #a second process loads the table from pop_data
+    cached = bevstat_precompute.Scheduler(None, data_dir, tables)
+    drain()
+    assert calls == ["table"]
+    assert cached.results["table"].tolist() == scheduler.results["table"].tolist()
+
+    #changed data gets a new version and the table is computed again
+    (tmp_path / "population.csv").write_text("1\n2\n")
+    changed = bevstat_precompute.Scheduler(None, data_dir, tables)
+    drain()
+    assert changed.version != scheduler.version
+    assert calls == ["table", "table"]
+
+
+def test_failed_table_is_delivered_as_none(data_dir, blocked_worker, caplog):
+    def fail(indicators):
+        raise RuntimeError("broken")
+
+    scheduler = bevstat_precompute.Scheduler(None, data_dir, dict(broken=(0, "", fail)))
+    document, received = RecordingDocument(), []
+    scheduler.subscribe(document, "broken", lambda name, table: received.append((name, table)))
+    blocked_worker.set()
+    drain()
+    for callback in document.next_tick_callbacks:
+        callback()
+    assert received == [("broken", None)]
+    assert "precomputing broken failed" in caplog.text
+
+
+def test_subscribe_before_and_after_the_result(data_dir, blocked_worker):
+    scheduler = bevstat_precompute.Scheduler(None, data_dir, counting_tables([], [("table", 0)]))
+    waiting, early = RecordingDocument(), []
+    scheduler.subscribe(waiting, "table", lambda name, table: early.append((name, table.tolist())))
+    assert early == [] and waiting.next_tick_callbacks == []
+
+    #subscribers that were waiting are called on their document's next tick, from the event loop
+    blocked_worker.set()
+    drain()
+    assert early == [] and len(waiting.next_tick_callbacks) == 1
+    waiting.next_tick_callbacks[0]()
+    assert early == [("table", [1, 2, 3])]
+
+    #later subscribers are called right away
+    ready, late = RecordingDocument(), []
+    scheduler.subscribe(ready, "table", lambda name, table: late.append((name, table.tolist())))
+    assert late == [("table", [1, 2, 3])] and ready.next_tick_callbacks == []